@@ -0,0 +1,2 @@
+# Without an __init__.py here, pytest adds this directory to the path so the tests can import yeti_example when they
+# are run from the root of the repository
@@ -1,13 +1,24 @@
+import os
 from pathlib import Path
 
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Iterable, Optional
 
 from my.commands import (
     CommandProcessRunner,
     args,
 )
 
+# Notes are small, so a bigger buffer than the default block size saves syscalls when appending many of them
+NOTEBOOK_BUFFER_SIZE = 1 << 17
+SMALL_NOTEBOOK_SIZE = 1 << 20
+
+
+def format_note(title: str, date: Optional[str] = None) -> bytes:
+    note_text = f"{date} - {title}" if date else title
+    return ("# " + note_text + "\n").encode()
+
 
 @dataclass
 class NewNote(CommandProcessRunner):
@@ -16,21 +27,46 @@ class NewNote(CommandProcessRunner):
     notebook: str = args(default="~/notes.txt")
 
     def run(self, **kwargs):
-        note_text = f"{self.title}"
-        if self.add_date:
-            note_text = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {note_text}"
+        date = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if self.add_date else None
 
-        with Path(self.notebook).expanduser().open("a") as f:
-            f.write("# " + note_text + "\n")
+        with open(Path(self.notebook).expanduser(), "ab", buffering=NOTEBOOK_BUFFER_SIZE) as f:
+            f.write(format_note(self.title, date))
 
         return ""
 
+    @classmethod
+    def run_many(cls, titles: Iterable[str], **kwargs):
+        """Append several notes to the notebook with a single write.
+
+        `kwargs` are the other fields of the notes (`add_date`, `notebook`), with the same defaults as for one note.
+        """
+        options = cls(title="", **kwargs)
+        date = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if options.add_date else None
+
+        notes = bytearray()
+        for title in titles:
+            notes += format_note(title, date)
+
+        with open(Path(options.notebook).expanduser(), "ab", buffering=NOTEBOOK_BUFFER_SIZE) as f:
+            f.write(notes)
+
 
 @dataclass
 class ListNotes(CommandProcessRunner):
     notebook: str = args(default="~/notes.txt")
 
     def run(self, **kwargs):
-        with Path(self.notebook).expanduser().open() as f:
-            for l in f.readlines():
-                yield l.rstrip("\n")
+        path = Path(self.notebook).expanduser()
+
+        # Small notebooks are read at once, bigger ones are streamed line by line. Both split the notes on newlines
+        # only, the same way
+        if os.stat(path).st_size < SMALL_NOTEBOOK_SIZE:
+            lines = path.read_text(encoding="utf-8").split("\n")
+            if not lines[-1]:
+                lines.pop()
+            yield from lines
+            return
+
+        with path.open(encoding="utf-8", buffering=NOTEBOOK_BUFFER_SIZE) as f:
+            for l in f:
+                yield l[:-1] if l[-1:] == "\n" else l
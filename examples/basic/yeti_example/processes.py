@@ -1,3 +1,5 @@
+from functools import partial
+
 from my.commands import (
     HIDDEN_ARGUMENT,
     OPTIONAL_ARGUMENT,
@@ -17,17 +19,21 @@ processes = PluginRegistry()
 
 
 # Helper dictionnary to define the different commands.
-# The key is the command path, dot separated, and the value is the command.
-# Example "notes.new": NewNote(...) will be exposed as `my notes new` in the command line.
+# The key is the command path, dot separated, and the value is the command class with its arguments.
+# Example "notes.new": (NewNote, {...}) will be exposed as `my notes new` in the command line.
+# The commands are only created when my-yeti runs them, not when this module is imported.
 COMMANDS = {
-    "notes.new": NewNote(
-        title=REQUIRED_ARGUMENT,
-        add_date=OPTIONAL_ARGUMENT(default=True, action="store_true"),
-        notebook=OPTIONAL_ARGUMENT,
+    "notes.new": (
+        NewNote,
+        dict(
+            title=REQUIRED_ARGUMENT,
+            add_date=OPTIONAL_ARGUMENT(default=True, action="store_true"),
+            notebook=OPTIONAL_ARGUMENT,
+        ),
     ),
-    "notes.list": ListNotes(notebook=OPTIONAL_ARGUMENT),
+    "notes.list": (ListNotes, dict(notebook=OPTIONAL_ARGUMENT)),
 }
 
-for path, command in COMMANDS.items():
+for path, (command_cls, command_kwargs) in COMMANDS.items():
     *export_path, name = path.split(".")
-    processes.add_process(name, command, export_path=".".join(export_path))
+    processes.add_process(name, partial(command_cls, **command_kwargs), export_path=".".join(export_path))
@@ -0,0 +1,42 @@
+import pytest
+
+from yeti_example import notes
+from yeti_example.notes import ListNotes, NewNote
+
+NOTEBOOK_CONTENT = "# first\r\n# é\x85   \x0c\n# last".encode()
+
+
+@pytest.mark.parametrize("small_notebook_size", [notes.SMALL_NOTEBOOK_SIZE, 0])
+def test_list_notes_small_and_big_notebooks(tmp_path, monkeypatch, small_notebook_size):
+    notebook = tmp_path / "notes.txt"
+    notebook.write_bytes(NOTEBOOK_CONTENT)
+    monkeypatch.setattr(notes, "SMALL_NOTEBOOK_SIZE", small_notebook_size)
+
+    assert list(ListNotes(notebook=str(notebook)).run()) == ["# first", "# é\x85   \x0c", "# last"]
+
+
+def test_list_notes_empty_notebook(tmp_path):
+    notebook = tmp_path / "notes.txt"
+    notebook.touch()
+
+    assert list(ListNotes(notebook=str(notebook)).run()) == []
+
+
+def test_new_note_run_many(tmp_path):
+    notebook = tmp_path / "notes.txt"
+    NewNote(title="first", add_date=False, notebook=str(notebook)).run()
+    NewNote.run_many(["second", "third"], add_date=False, notebook=str(notebook))
+
+    assert list(ListNotes(notebook=str(notebook)).run()) == ["# first", "# second", "# third"]
+
+
+def test_new_note_run_many_uses_note_defaults(tmp_path, monkeypatch):
+    # The default notebook is in the home directory, which is USERPROFILE on Windows
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    NewNote.run_many(["first", "second"])
+
+    listed = list(ListNotes().run())
+    assert len(listed) == 2
+    assert listed[0] != "# first" and listed[0].endswith(" - first")
+    assert listed[1].endswith(" - second")
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 
+import sys
 from argparse import ArgumentParser
 from copy import deepcopy
 from dataclasses import MISSING, Field, dataclass, field, fields, replace
-from typing import Any, Callable, Dict, List, Tuple, TypeVar, Union
+from types import MappingProxyType
+from typing import (Any, Callable, Dict, Hashable, List, Mapping, NamedTuple,
+                    Optional, Tuple, TypeVar, Union)
 
 TExpose = TypeVar("TExpose", bound="ExposeArguments")
 _T = TypeVar("_T")
 
 ARGPARSE_METADATA_NAME = "argparse"
+# Maximum number of _arguments results cached per class
+ARGUMENTS_CACHE_SIZE = 128
 
 
 class _SPECIAL_ARGUMENT:
@@ -41,15 +46,56 @@ OPTIONAL_ARGUMENT = _OPTIONAL_ARGUMENT()
 
 _SPECIAL_ARGUMENT_VALUES = [REQUIRED_ARGUMENT, HIDDEN_ARGUMENT, OPTIONAL_ARGUMENT]
 
+# Kind of special argument of each type of value, including the aliases. Subclasses of the special arguments are
+# added on first use, so they are only resolved once from their MRO. Other types are never stored.
+_NOT_SPECIAL = 0
+_REQUIRED = 1
+_OPTIONAL = 2
+_HIDDEN = 3
+_SPECIAL_KINDS: Dict[type, int] = {
+    _REQUIRED_ARGUMENT: _REQUIRED,
+    type(Ellipsis): _REQUIRED,
+    _OPTIONAL_ARGUMENT: _OPTIONAL,
+    _HIDDEN_ARGUMENT: _HIDDEN,
+}
+
+
+def _special_kind(obj: Any) -> int:
+    obj_type = type(obj)
+    kind = _SPECIAL_KINDS.get(obj_type)
+    if kind is not None:
+        return kind
+    if not isinstance(obj, _SPECIAL_ARGUMENT):
+        return _NOT_SPECIAL
+
+    kind = next((k for t in obj_type.__mro__ if (k := _SPECIAL_KINDS.get(t)) is not None), _NOT_SPECIAL)
+    _SPECIAL_KINDS[obj_type] = kind
+    return kind
+
+
+def _is_required(obj: Any) -> bool:
+    return _special_kind(obj) == _REQUIRED
+
+
+def _is_optional(obj: Any) -> bool:
+    return _special_kind(obj) == _OPTIONAL
+
+
+def _is_hidden(obj: Any) -> bool:
+    return _special_kind(obj) == _HIDDEN
+
 
 def is_special_argument(obj: Any, special_args: Union[List[Any], Tuple[Any], Any] = _SPECIAL_ARGUMENT_VALUES) -> bool:
+    if special_args is _SPECIAL_ARGUMENT_VALUES:
+        return _special_kind(obj) != _NOT_SPECIAL
     if isinstance(special_args, list):
         special_args = tuple(special_args)
     if not isinstance(special_args, tuple):
         special_args = tuple([special_args])
     aliases = tuple([alias for arg in special_args for alias in getattr(arg, "aliases", [])])
     types = tuple([type(arg) for arg in special_args + aliases if type(arg) is not type])
-    return isinstance(obj, types) or any(obj == arg for arg in special_args)
+    # The special arguments are singletons, an identity check avoids calling __eq__ on arbitrary field values
+    return any(obj is arg for arg in special_args) or isinstance(obj, types)
 
 
 def smart_replace(obj, **kwargs):
@@ -91,9 +137,12 @@ def args(*args: _T, **kwargs) -> _T:
         field_kwargs["default"] = kwargs["default"]
     elif "default_factory" in kwargs:
         field_kwargs["default_factory"] = kwargs["default_factory"]
+    # The metadata is shared by every instance so it is made read-only, _arguments copies it before modifying it
     return field(
         metadata={
-            ARGPARSE_METADATA_NAME: {"args": list(args), "kwargs": kwargs, "exclude": kwargs.get("exclude", False)}
+            ARGPARSE_METADATA_NAME: MappingProxyType(
+                {"args": tuple(args), "kwargs": MappingProxyType(kwargs), "exclude": kwargs.get("exclude", False)}
+            )
         },
         **field_kwargs,
     )
@@ -104,20 +153,97 @@ def argslug(s: str) -> str:
     return s.replace("_", "-")
 
 
+# Shared result of _arguments when no field is exposed
+_NO_ARGUMENTS: Mapping[str, Mapping[str, Any]] = MappingProxyType({})
+
+
+def _read_only_arguments(arguments: Dict[str, Dict[str, Any]]) -> Mapping[str, Mapping[str, Any]]:
+    """Read-only view of cached _arguments results, the lists of argument names are copied (tuples are kept)"""
+    return MappingProxyType(
+        {
+            name: MappingProxyType(
+                {
+                    **argparse_args,
+                    "args": argparse_args["args"][:],
+                    "kwargs": MappingProxyType(argparse_args["kwargs"]),
+                }
+            )
+            for name, argparse_args in arguments.items()
+        }
+    )
+
+
+class _ExposedField(NamedTuple):
+    field: Field
+    name: str
+    argparse_metadata: Optional[Mapping[str, Any]]
+    exposes_arguments: bool
+    # MISSING if the field has no plain default value. Default factories are called each time, as each instance must get
+    # its own value
+    default: Any
+    # Name of the argument when it's positional and when it's optional (eg. `this_is_a_field` / `--this-is-a-field`)
+    arg_name: str
+    option_name: str
+    # Keyword arguments given to argparse from the metadata. argparse does not use the default_factory (the default
+    # value is computed by _arguments), so it is removed.
+    argparse_kwargs: Mapping[str, Any]
+
+    @property
+    def has_fresh_default(self) -> bool:
+        return self.default is MISSING and self.field.default_factory is not MISSING
+
+    def default_value(self, missing: Any = None) -> Any:
+        if self.default is not MISSING:
+            return self.default
+        if self.field.default_factory is not MISSING:
+            return self.field.default_factory()
+        return missing
+
+
 class ExposeArguments:
+    @classmethod
+    def _exposed_fields(cls) -> Tuple[_ExposedField, ...]:
+        # The fields are only known once the @dataclass decorator ran on the class (so after __init_subclass__),
+        # hence they are computed on first use and cached on the class itself.
+        exposed_fields = cls.__dict__.get("__yeti_fields__")
+        if exposed_fields is None:
+            exposed_fields = []
+            for f in fields(cls):
+                argparse_metadata = f.metadata.get(ARGPARSE_METADATA_NAME)
+                arg_name = sys.intern(
+                    argparse_metadata["args"][0] if argparse_metadata and argparse_metadata["args"] else f.name
+                )
+                argparse_kwargs = dict(argparse_metadata["kwargs"]) if argparse_metadata else {}
+                argparse_kwargs.pop("default_factory", None)
+                exposed_fields.append(
+                    _ExposedField(
+                        field=f,
+                        name=sys.intern(f.name),
+                        argparse_metadata=argparse_metadata,
+                        exposes_arguments=type(f.type) is type and issubclass(f.type, ExposeArguments),
+                        default=f.default,
+                        arg_name=arg_name,
+                        option_name=sys.intern(argslug("--" + arg_name)),
+                        argparse_kwargs=MappingProxyType(argparse_kwargs),
+                    )
+                )
+            exposed_fields = tuple(exposed_fields)
+            cls.__yeti_fields__ = exposed_fields
+        return exposed_fields
+
     def add_arguments(self, parser: ArgumentParser, add_all_fields: bool = False) -> None:
         for _, argparse_args in self._arguments(add_all_fields=add_all_fields).items():
             if argparse_args.get("exclude", False):
                 continue
             parser.add_argument(*argparse_args["args"], **argparse_args["kwargs"])
 
-        for f in fields(self):
-            if type(f.type) is type and issubclass(f.type, ExposeArguments):
-                getattr(self, f.name).add_arguments(parser, add_all_fields=add_all_fields)
+        for exposed in self._exposed_fields():
+            if exposed.exposes_arguments:
+                getattr(self, exposed.name).add_arguments(parser, add_all_fields=add_all_fields)
 
     def _arguments(
         self, add_all_fields: Union[bool, Callable[[TExpose, Field], bool]] = True
-    ) -> Dict[str, Dict[str, Any]]:
+    ) -> Mapping[str, Mapping[str, Any]]:
         """
         Create arguments from metaclass fields
 
@@ -134,64 +260,111 @@ class ExposeArguments:
         For a field `this_is_a_field`:
         - If it is required, it becomes a positional argument `this_is_a_field` (argument field name: `this_is_a_field`)
         - If it is optional, it becomes an optional argument `--this-is-a-field` (argument field name: `this_is_a_field`)
+
+        The result only depends on the class and on the special arguments set on the instance, so it is cached on the
+        class. Cached results are shared, so they are returned read-only.
         """
+        if add_all_fields is False:
+            return _NO_ARGUMENTS
+
+        cache_key = self._arguments_cache_key(add_all_fields)
+        if cache_key is None:
+            return self._compute_arguments(add_all_fields)
+
+        _, special_values = cache_key
+        if not any(_is_required(value) or _is_optional(value) for value in special_values):
+            return _NO_ARGUMENTS
+
+        cache = type(self).__dict__.get("__yeti_arguments__")
+        if cache is None:
+            cache = {}
+            type(self).__yeti_arguments__ = cache
+
+        if cache_key not in cache:
+            # Special arguments can be created for each instance, so the cache is kept small
+            if len(cache) >= ARGUMENTS_CACHE_SIZE:
+                cache.clear()
+            cache[cache_key] = self._compute_arguments(add_all_fields)
+
+        return _read_only_arguments(cache[cache_key])
+
+    def _arguments_cache_key(self, add_all_fields: Union[bool, Callable[[TExpose, Field], bool]]) -> Optional[Hashable]:
+        """Key of the _arguments cache for this instance, None if the result cannot be cached"""
+        # Predicates are usually created on the fly, caching on them would never be hit
+        if not isinstance(add_all_fields, bool):
+            return None
+
+        special_values = []
+        for exposed in self._exposed_fields():
+            if exposed.field.init is False:
+                continue
+
+            field_val = getattr(self, exposed.name)
+            if not is_special_argument(field_val):
+                special_values.append(None)
+            elif _is_optional(field_val) and exposed.has_fresh_default:
+                # The default value given to argparse is a new copy each time
+                return None
+            else:
+                special_values.append(field_val)
+
+        return add_all_fields, tuple(special_values)
+
+    def _compute_arguments(
+        self, add_all_fields: Union[bool, Callable[[TExpose, Field], bool]]
+    ) -> Dict[str, Dict[str, Any]]:
         if isinstance(add_all_fields, bool):
             include_field = lambda _1, _2: add_all_fields
         else:
             include_field = add_all_fields
 
         args = {}
-        for f in fields(self):
+        for exposed in self._exposed_fields():
+            f = exposed.field
             # Skip fields not present in __init__
             if f.init is False:
                 continue
 
             # ======== FIELD VALUE =======================
-            field_name = f.name
+            field_name = exposed.name
             field_val = getattr(self, field_name)
-            default_val = (
-                f.default
-                if f.default is not MISSING
-                else f.default_factory()
-                if f.default_factory is not MISSING
-                else None
-            )
 
             # If the field is not required
-            if not is_special_argument(field_val, [REQUIRED_ARGUMENT, OPTIONAL_ARGUMENT]):
+            if not (_is_required(field_val) or _is_optional(field_val)):
                 continue
 
             # Special argument but the predicate decided to skip it
             if not include_field(self, f):
                 continue
 
+            # Only computed for exposed fields, as it may call a default factory
+            default_val = exposed.default_value()
+
             # We have actual metadata on the field so we use it
-            if ARGPARSE_METADATA_NAME in f.metadata:
-                argparse_args = deepcopy(f.metadata[ARGPARSE_METADATA_NAME])
-                # We already have the default value and argparse does not use the default_factory, so
-                # we delete this attribute
-                if "default_factory" in argparse_args["kwargs"]:
-                    del argparse_args["kwargs"]["default_factory"]
+            if exposed.argparse_metadata is not None:
+                # The argument name is set below, only the kwargs prepared with the class fields are needed
+                argparse_args = {
+                    "args": [],
+                    "kwargs": dict(exposed.argparse_kwargs),
+                    "exclude": exposed.argparse_metadata["exclude"],
+                }
             else:
                 # We construct some basic arguments
                 argparse_args = {"args": [], "exclude": False, "kwargs": {"default": field_val}}
 
             # ======== ARGUMENT NAME =====================
-            # Use the field name if args is not specified
-            if not argparse_args["args"]:
-                arg_name = f.name
-            else:
-                arg_name = argparse_args["args"][0]
+            # The names are computed once per class: the field name if args is not specified, or its first element
+            arg_name = exposed.arg_name
 
             field_is_optional = False
-            if field_val == default_val or is_special_argument(field_val, OPTIONAL_ARGUMENT):
-                arg_name = argslug("--" + arg_name)
+            if field_val == default_val or _is_optional(field_val):
+                arg_name = exposed.option_name
                 field_is_optional = True
 
             # ======== ARGUMENT DEFAULT ==================
-            if is_special_argument(field_val, OPTIONAL_ARGUMENT):
+            if _is_optional(field_val):
                 argparse_args["kwargs"]["default"] = default_val
-            elif is_special_argument(field_val, REQUIRED_ARGUMENT) and "default" in argparse_args["kwargs"]:
+            elif _is_required(field_val) and "default" in argparse_args["kwargs"]:
                 # Field is required, so we delete the default value
                 del argparse_args["kwargs"]["default"]
 
@@ -200,6 +373,7 @@ class ExposeArguments:
             ]
 
             # Override argparse args and kwargs if they are set on the special argument
+            new_args = None
             if is_special_argument(field_val):
                 if new_args := getattr(field_val, "argparse_args", []):
                     argparse_args["args"] = new_args
@@ -209,7 +383,7 @@ class ExposeArguments:
             # TODO Right now, arguments set on the field are overriden by arguments set on the special value except
             #      for "dest" which is defined by the field_name. Should it be possible to define it on the field ?
             # dest should always be the field name to keep namespace coherent (so an argument A cannot be written as B)
-            if argslug(argparse_args["args"][0]) != argslug(arg_name):
+            if new_args and argslug(new_args[0]) != argslug(arg_name):
                 if field_is_optional:
                     argparse_args["kwargs"]["dest"] = field_name
                 else:
@@ -226,10 +400,11 @@ class ExposeArguments:
     def with_arguments(self: TExpose, **kwargs) -> TExpose:
         new_fields = {}
         # Replace subfields that also expose arguments
-        for f in fields(self):
-            if type(f.type) is type and issubclass(f.type, ExposeArguments):
+        for exposed in self._exposed_fields():
+            f = exposed.field
+            if exposed.exposes_arguments:
                 new_fields[f.name] = getattr(self, f.name).with_arguments(**kwargs)
-            if is_special_argument(getattr(self, f.name), HIDDEN_ARGUMENT):
+            if _is_hidden(getattr(self, f.name)):
                 field_value = (
                     f.default
                     if f.default is not MISSING
@@ -244,7 +419,7 @@ class ExposeArguments:
         useful_kwargs = {}
         for field_name, new_value in kwargs.items():
             # TODO Check that the field `field_name` in fields(self) did actually enable argparse
-            if hasattr(self, field_name) and not is_special_argument(new_value, REQUIRED_ARGUMENT):
+            if hasattr(self, field_name) and not _is_required(new_value):
                 # assert (
                 #     getattr(self, field_name) == ...
                 # ), "We can only override values that were set to the Ellipsis right now"
@@ -1,18 +1,20 @@
 #!/usr/bin/env python3
 
 import logging
-import select
+import os
+import selectors
 import shlex
 import subprocess
 import sys
-import time
+import threading
 from argparse import ArgumentParser
 from copy import deepcopy
 from dataclasses import Field, dataclass, field, fields, replace
 from datetime import datetime
-from io import BufferedReader, StringIO
+from io import BufferedReader, StringIO, TextIOBase
+from pprint import pformat
 from types import MethodType
-from typing import (IO, Any, Callable, Dict, Generator, Generic, List,
+from typing import (IO, Any, Callable, Dict, Generator, Iterable, List,
                     Optional, Tuple, TypeVar, Union)
 
 from my.commands.arguments import (ExposeArguments, args, field_value,
@@ -26,6 +28,47 @@ logger = logging.getLogger(__name__)
 T = TypeVar("T")
 TProc = TypeVar("TProc", bound="ProcessRunner")
 
+# Size of the reads done on the process pipes
+READ_CHUNK_SIZE = 65536
+# Seconds between two checks that a process exited, while its pipes have nothing to read
+PROCESS_EXIT_CHECK_INTERVAL = 0.1
+
+
+def _split_carriage_returns(line: bytes) -> List[bytes]:
+    """Splits a line on "\r" too, as universal newlines do in text mode ("\r\n" only ends the line once)"""
+    if b"\r" not in line:
+        return [line]
+    parts = line.split(b"\r")
+    if not parts[-1]:
+        parts.pop()
+    return parts
+
+
+def read_lines(fd: int, universal_newlines: bool = True) -> Generator[str, None, None]:
+    """Yields the lines read from a file descriptor until EOF, reading it by chunks.
+
+    With `universal_newlines`, lines are split like text mode pipes do ("\r" also ends a line), otherwise only on
+    "\n".
+    """
+    split_line = _split_carriage_returns if universal_newlines else lambda line: [line]
+    buf = bytearray()
+    while chunk := os.read(fd, READ_CHUNK_SIZE):
+        buf += chunk
+        end = buf.rfind(b"\n")
+        if end == -1:
+            continue
+        for line in buf[:end].split(b"\n"):
+            for part in split_line(line):
+                yield part.decode("utf-8")
+        del buf[: end + 1]
+
+    for part in split_line(buf) if buf else []:
+        yield part.decode("utf-8")
+        del buf[: end + 1]
+
+    for part in _split_carriage_returns(buf) if buf else []:
+        yield part.decode("utf-8")
+
 
 def escape_arg(s: str) -> str:
     """Returns a string that can be safely given to a shell as a single arg"""
@@ -54,12 +97,7 @@ class ProcessRunner(ExposeArguments):
         if isinstance(other, StdinConverter):
             return SequentialProcessRunner(self, other, piped=False)
 
-        if isinstance(self, SequentialProcessRunner):
-            if self.piped:
-                return SequentialProcessRunner(*self.subprocesses, other, piped=True)
-            else:
-                return SequentialProcessRunner(self, other, piped=True)
-
+        # Piped sequences are inlined by SequentialProcessRunner itself
         return SequentialProcessRunner(self, other, piped=True)
 
     def description(self, description):
@@ -70,14 +108,27 @@ class ProcessRunner(ExposeArguments):
 @dataclass
 class CommandProcessRunner(ProcessRunner):
     text: bool = field(init=False, default=True)
+    # Commands that don't need shell features (pipes, redirections,...) can disable it to skip spawning a shell.
+    # The command is then split into the executable arguments and no escaping is needed.
+    shell: bool = field(init=False, default=True)
 
-    def finalize_cmd(self) -> str:
+    def finalize_cmd(self) -> Union[str, List[str]]:
         pass
 
-    def prepare_cmd(self, **kwargs) -> str:
-        return self.finalize_cmd().format(**kwargs)
+    def prepare_cmd(self, **kwargs) -> Union[str, List[str]]:
+        cmd = self.finalize_cmd()
+        if self.shell:
+            if not isinstance(cmd, str):
+                cmd = " ".join(escape_arg(arg) for arg in cmd)
+            return cmd.format(**kwargs)
 
-    def create_args(self, kwargs: Dict[str, Union[List[str], str]], *positional_args: str, joiner="=") -> str:
+        if isinstance(cmd, str):
+            cmd = shlex.split(cmd)
+        return [arg.format(**kwargs) for arg in cmd]
+
+    def _args_list(
+        self, kwargs: Dict[str, Union[List[str], str]], positional_args: Tuple[str, ...], joiner: str, escape
+    ) -> List[str]:
         args = []
         for k, v in kwargs.items():
             if isinstance(v, list):
@@ -89,12 +140,19 @@ class CommandProcessRunner(ProcessRunner):
                 if sub is None:
                     args.append(k)
                 else:
-                    args.append(f"{k}{joiner}{escape_arg(sub)}")
+                    args.append(f"{k}{joiner}{escape(sub)}")
 
         for pos_arg in positional_args:
-            args.append(escape_arg(pos_arg))
+            args.append(escape(pos_arg))
+
+        return args
 
-        return " ".join(args)
+    def create_args(self, kwargs: Dict[str, Union[List[str], str]], *positional_args: str, joiner="=") -> str:
+        return " ".join(self._args_list(kwargs, positional_args, joiner, escape=escape_arg))
+
+    def create_argv(self, kwargs: Dict[str, Union[List[str], str]], *positional_args: str, joiner="=") -> List[str]:
+        """Same as `create_args` but as a list of arguments, for commands that are not run through a shell"""
+        return self._args_list(kwargs, positional_args, joiner, escape=str)
 
     def _run_async(self, /, stdin=None, stdout=None, **kwargs) -> Tuple[subprocess.Popen, Optional[IO], Optional[IO]]:
         complete_cmd = self.prepare_cmd(**kwargs)
@@ -104,7 +162,7 @@ class CommandProcessRunner(ProcessRunner):
         # TODO Python Subprocess presentation https://realpython.com/python-subprocess/#connecting-two-processes-together-with-pipes
         proc = subprocess.Popen(
             complete_cmd,
-            shell=True,
+            shell=self.shell,
             text=self.text,
             stdin=stdin if stdin else subprocess.PIPE,
             stdout=subprocess.PIPE,
@@ -118,44 +176,70 @@ class CommandProcessRunner(ProcessRunner):
     def run(self, /, stdin=None, stdout=None, **kwargs) -> Generator[str, None, None]:
         proc, proc_stdout, proc_stderr = self._run_async(stdin=stdin, **kwargs)
 
-        stdout_poll = select.poll()
-        if proc_stdout is not None:
-            stdout_poll.register(proc_stdout, select.POLLIN)
-        stderr_poll = select.poll()
-        if proc_stderr is not None:
-            stderr_poll.register(proc_stderr, select.POLLIN)
-
-        run_once_more = True
-        while proc.poll() is None or run_once_more:
-            run_once_more = proc.poll() is None
-            while p := stdout_poll.poll(1) and proc_stdout is not None:
-                orig_line = proc_stdout.readline()
-                if not orig_line:
+        # Wait for the pipes to be readable instead of polling them with a sleep, and read whatever is available
+        # so each line is yielded as soon as the process wrote it. The selector data tells if it's stdout.
+        selector = selectors.DefaultSelector()
+        buffers: Dict[int, bytearray] = {}
+        for pipe, is_stdout in [(proc_stdout, True), (proc_stderr, False)]:
+            if pipe is None:
+                continue
+            fd = pipe.fileno()
+            os.set_blocking(fd, False)
+            selector.register(fd, selectors.EVENT_READ, is_stdout)
+            buffers[fd] = bytearray()
+
+        with selector:
+            while selector.get_map():
+                ready = selector.select(timeout=PROCESS_EXIT_CHECK_INTERVAL)
+                if not ready and proc.poll() is not None:
+                    # The process exited but its pipes are still open, eg. held by a background child of the shell.
+                    # Nothing is left to read, the remaining bytes are the last lines.
+                    for key in list(selector.get_map().values()):
+                        selector.unregister(key.fd)
+                        buf = buffers[key.fd]
+                        yield from self._output_lines([buf] if buf else [], key.data, stdout)
                     break
-                line = orig_line[:-1]
-                line = line if self.text else line.decode("utf-8")
-                if stdout:
-                    stdout.write(line)
-                yield line
 
-            while stderr_poll.poll(1) and proc_stderr is not None:
-                ## Currently, we don't yield stderr lines as we don't want them
-                ## tangled with the rest but we can print them
-                orig_line = proc_stderr.readline()
-                if not orig_line:
-                    break
-                line = orig_line[:-1]
-                line = line if self.text else line.decode("utf-8")
-                if stdout:
-                    stdout.write(line)
+                for key, _ in ready:
+                    try:
+                        chunk = os.read(key.fd, READ_CHUNK_SIZE)
+                    except BlockingIOError:
+                        continue
+
+                    buf = buffers[key.fd]
+                    if chunk:
+                        buf += chunk
+                        end = buf.rfind(b"\n")
+                        if end == -1:
+                            continue
+                        lines = buf[:end].split(b"\n")
+                        del buf[: end + 1]
+                    else:
+                        # EOF: the remaining bytes are the last line if it didn't end with a newline
+                        selector.unregister(key.fd)
+                        lines = [buf] if buf else []
 
-            time.sleep(0.1)
+                    yield from self._output_lines(lines, key.data, stdout)
 
+        proc.wait()
         if proc.returncode != 0:
             raise subprocess.CalledProcessError(proc.returncode, proc.args)
 
         return
 
+    def _output_lines(self, lines: List[bytes], is_stdout: bool, stdout=None) -> Generator[str, None, None]:
+        if self.text:
+            lines = [part for line in lines for part in _split_carriage_returns(line)]
+
+        for line in lines:
+            line = line.decode("utf-8")
+            if stdout:
+                stdout.write(line)
+            ## Currently, we don't yield stderr lines as we don't want them
+            ## tangled with the rest but we can print them
+            if is_stdout:
+                yield line
+
     def __str__(self):
         if type(self) is CommandProcessRunner:
             return f"Command[{self.finalize_cmd()}]"
@@ -185,7 +269,17 @@ class SequentialProcessRunner(ProcessRunner):
     piped: bool = False
 
     def __init__(self, *subprocesses: ProcessRunner, piped: bool = False):
-        self.subprocesses = list(subprocesses)
+        if piped:
+            # Nested pipes are the same pipe, so their processes are inlined to avoid recursing through them when
+            # running the pipe or adding its arguments. Non-piped sequences are kept as they are since a
+            # StdinConverter receives the output of the whole previous process.
+            self.subprocesses = [
+                p
+                for sub in subprocesses
+                for p in (sub.subprocesses if isinstance(sub, SequentialProcessRunner) and sub.piped else [sub])
+            ]
+        else:
+            self.subprocesses = list(subprocesses)
         self.piped = piped
 
     def prepare(self, **kwargs) -> "SequentialProcessRunner":
@@ -217,32 +311,41 @@ class SequentialProcessRunner(ProcessRunner):
         return last_proc, last_proc.stdout, last_proc.stderr
 
     def run(self, /, stdin=None, stdout=None, **kwargs) -> Generator[str, None, None]:
-        outputs = []
         if not self.piped:
-            sub_outputs = []
-            for sub in self.subprocesses:
+            sub_outputs: List[str] = []
+            for i, sub in enumerate(self.subprocesses, start=1):
+                # The output is only kept when the next process is a StdinConverter, as it needs all of it
+                keep_output = i < len(self.subprocesses) and isinstance(self.subprocesses[i], StdinConverter)
                 try:
                     if isinstance(sub, StdinConverter):
-                        sub_outputs = sub.run_with_output("\n".join(sub_outputs), stdin=stdin, stdout=stdout, **kwargs)
+                        lines = sub.run_with_output(sub_outputs, stdin=stdin, stdout=stdout, **kwargs)
                     else:
-                        sub_outputs = list(sub.run(stdin=stdin, stdout=stdout, **kwargs))
-                    outputs.extend(sub_outputs)
+                        lines = sub.run(stdin=stdin, stdout=stdout, **kwargs)
+
+                    sub_outputs = []
+                    for line in lines:
+                        if keep_output:
+                            sub_outputs.append(line)
+                        yield line
                 except subprocess.CalledProcessError as e:
                     logger.info(f"Process {sub} failed with error {str(e)}")
                     raise
         else:
-
             proc, proc_stdout, proc_stderr = self._run_async(stdin=stdin, stdout=stdout, **kwargs)
-            # Wait for the last process to finish
-            proc.wait()
 
-            outputs_str = proc_stdout.read()
-            if isinstance(outputs_str, bytes):
-                outputs_str = outputs_str.decode("utf-8")
+            # Drain stderr in the background, otherwise the process blocks once its stderr pipe is full
+            stderr_thread = None
+            if proc_stderr is not None:
+                stderr_thread = threading.Thread(target=proc_stderr.read, daemon=True)
+                stderr_thread.start()
 
-            outputs = outputs_str.split("\n")[:-1]
+            # The last process decides if the output is read as text
+            yield from read_lines(proc_stdout.fileno(), universal_newlines=isinstance(proc_stdout, TextIOBase))
 
-        return outputs
+            # Wait for the last process to finish
+            proc.wait()
+            if stderr_thread is not None:
+                stderr_thread.join()
 
     def __str__(self):
         joiner = " | " if self.piped else ", "
@@ -267,13 +370,19 @@ class SequentialProcessRunner(ProcessRunner):
 class StdinConverter(ProcessRunner):
     target: ProcessRunner
     converter: Callable[[str], Dict[str, object]]
+    # If True, the converter is given the output lines instead of the whole output joined in a string
+    accepts_iterable: bool = False
 
     def add_arguments(self, parser, add_all_fields: bool) -> None:
         # We want to expose fields that are optional and those that are REQUIRED but not set to "..."
         only_add_fields = lambda self, field: getattr(self, field.name) is not ...
         self.target.add_arguments(parser, add_all_fields=only_add_fields)
 
-    def run_with_output(self, output: str, /, stdin=None, stdout=None, **kwargs) -> Generator[str, None, None]:
+    def run_with_output(
+        self, output: Union[str, Iterable[str]], /, stdin=None, stdout=None, **kwargs
+    ) -> Generator[str, None, None]:
+        if not self.accepts_iterable and not isinstance(output, str):
+            output = "\n".join(output)
         process = smart_replace(self.target, **self.converter(output))
         return process.run(stdin=stdin, stdout=stdout, **kwargs)
 
@@ -297,8 +406,6 @@ class Print(ProcessRunner):
     obj: Any
 
     def run(self, /, stdin=None, stdout=None, **kwargs) -> Generator[str, None, None]:
-        from pprint import pformat
-
         yield pformat(self.obj)
 
         return
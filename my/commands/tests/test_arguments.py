@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Dict, List, Set
 
 import pytest
@@ -9,8 +9,9 @@ import pytest
 from my.commands import (HIDDEN_ARGUMENT, OPTIONAL_ARGUMENT, REQUIRED_ARGUMENT,
                          Command, CommandProcessRunner, ExposeArguments,
                          ProcessRunner, SequentialProcessRunner,
-                         StdinConverter, args, final_value)
-from my.commands.arguments import _OPTIONAL_ARGUMENT
+                         StdinConverter, args, field_value, final_value)
+from my.commands.arguments import (_OPTIONAL_ARGUMENT, _SPECIAL_KINDS,
+                                   is_special_argument, smart_replace)
 
 
 @pytest.fixture
@@ -23,7 +24,7 @@ def commands_with_hole():
     return Command(cmd=...), SequentialProcessRunner()
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def command_class():
     @dataclass
     class Notify(CommandProcessRunner):
@@ -40,6 +41,17 @@ def test_piped_composition(simple_commands):
     assert composed == SequentialProcessRunner(c1, c2, piped=True)
 
 
+def test_nested_piped_composition_is_flattened(simple_commands):
+    c1, c2 = simple_commands
+    c3 = Command("again")
+
+    assert c1 | (c2 | c3) == SequentialProcessRunner(c1, c2, c3, piped=True)
+    assert (c1 | c2) | c3 == SequentialProcessRunner(c1, c2, c3, piped=True)
+
+    sequence = SequentialProcessRunner(c1, c2)
+    assert (sequence | c3).subprocesses == [sequence, c3]
+
+
 def test_find_hole_in_command():
     c = Command(cmd=...)
     assert c._arguments() == {
@@ -79,8 +91,8 @@ def check_action_attributes(
         assert action.dest in expected_arguments
         actions_name.add(action.dest)
         expected_action = expected_arguments[action.dest]
-        for attr_name, attr_value in expected_action.items():
-            assert getattr(action, attr_name) == attr_value
+        actual_action = {attr_name: getattr(action, attr_name) for attr_name in expected_action}
+        assert actual_action == expected_action, (action.dest, actual_action, expected_action)
 
     assert actions_name == set(expected_arguments.keys())
     return True
@@ -171,6 +183,23 @@ def test_expose_arguments_on_simple_default():
     ), "The argument was not created with args so it should not be exposed"
 
 
+def test_expose_arguments_cached_result_is_read_only():
+    @dataclass
+    class A(ExposeArguments):
+        default_argument: str = "ABC"
+
+    arguments = A(default_argument=OPTIONAL_ARGUMENT)._arguments(add_all_fields=True)
+    with pytest.raises(TypeError):
+        arguments["other_argument"] = {}
+    with pytest.raises(TypeError):
+        arguments["default_argument"]["kwargs"]["default"] = "DEF"
+    arguments["default_argument"]["args"].append("--oops")
+
+    assert A(default_argument=OPTIONAL_ARGUMENT)._arguments(add_all_fields=True) == {
+        "default_argument": {"args": ["--default-argument"], "exclude": False, "kwargs": {"default": "ABC"}}
+    }
+
+
 def test_expose_arguments_with_args():
     @dataclass
     class A(ExposeArguments):
@@ -181,6 +210,19 @@ def test_expose_arguments_with_args():
     }
 
 
+def test_expose_arguments_default_factory_gives_new_values():
+    @dataclass
+    class A(ExposeArguments):
+        default_argument: List[str] = field(default_factory=list)
+
+    arguments = A(default_argument=OPTIONAL_ARGUMENT)._arguments(add_all_fields=True)
+    arguments["default_argument"]["kwargs"]["default"].append("modified")
+
+    assert A(default_argument=OPTIONAL_ARGUMENT)._arguments(add_all_fields=True) == {
+        "default_argument": {"args": ["--default-argument"], "exclude": False, "kwargs": {"default": []}}
+    }
+
+
 def test_expose_optional_argument_subclass():
     @dataclass
     class A(ExposeArguments):
@@ -196,6 +238,19 @@ def test_expose_optional_argument_subclass():
     }
 
 
+def test_special_kinds_only_cache_special_arguments():
+    class Value:
+        pass
+
+    class _SPECIAL_OPTIONAL_ARGUMENT(_OPTIONAL_ARGUMENT):
+        pass
+
+    assert not is_special_argument(Value())
+    assert Value not in _SPECIAL_KINDS
+    assert is_special_argument(_SPECIAL_OPTIONAL_ARGUMENT())
+    assert _SPECIAL_OPTIONAL_ARGUMENT in _SPECIAL_KINDS
+
+
 def test_expose_arguments_of_subclass():
     @dataclass
     class A(ExposeArguments):
@@ -443,6 +498,47 @@ def test_with_argument_with_no_argument_should_return_the_class_default_values()
     assert cmd.with_arguments().default_arg2 == "nails"
 
 
+def test_arguments_are_cached_per_special_arguments():
+    @dataclass
+    class A(ExposeArguments):
+        a: str = "a"
+        b: List[str] = args(default_factory=list)
+        c: List[str] = field_value(["c"])
+
+    assert A(a=OPTIONAL_ARGUMENT)._arguments() == A(a=OPTIONAL_ARGUMENT)._arguments()
+    assert len(A.__yeti_arguments__) == 1
+    assert A(a=OPTIONAL_ARGUMENT)._arguments() != A(a=REQUIRED_ARGUMENT)._arguments()
+    assert len(A.__yeti_arguments__) == 2
+    assert A(a=OPTIONAL_ARGUMENT)._arguments(add_all_fields=False) == {}
+
+    # Special arguments with their own argparse arguments are different keys
+    assert A(a=OPTIONAL_ARGUMENT("--x"))._arguments()["a"]["args"] == ("--x",)
+    assert A(a=OPTIONAL_ARGUMENT("--y"))._arguments()["a"]["args"] == ("--y",)
+
+    # Default values created for each instance are not shared
+    default = A(c=OPTIONAL_ARGUMENT)._arguments()["c"]["kwargs"]["default"]
+    assert A(c=OPTIONAL_ARGUMENT)._arguments()["c"]["kwargs"]["default"] is not default
+    assert A(c=OPTIONAL_ARGUMENT)._arguments()["c"]["kwargs"]["default"] == ["c"]
+
+
+def test_smart_replace():
+    @dataclass
+    class A(ExposeArguments):
+        name: str
+        count: int = 0
+
+    @dataclass
+    class B(ExposeArguments):
+        a: A
+        children: List[A]
+
+    b = B(a=A("a"), children=[A("c1"), A("c2")])
+    new_b = smart_replace(b, a={"name": "new"}, **{"children[]": {"count": 2, "unknown": 1}})
+
+    assert new_b == B(a=A("new"), children=[A("c1", count=2), A("c2", count=2)])
+    assert smart_replace(b, a=A("other")).a == A("other")
+
+
 # TODO Test that default argument is found
 # TODO Test that args() adds type, default, default_factory,...
 # TODO Test that simple default argument has {"args": ("<arg_name>",)} in _arguments
@@ -0,0 +1,92 @@
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from io import StringIO
+
+import pytest
+
+from my.commands import (Command, CommandBinaryMode, SequentialProcessRunner,
+                         StdinConverter)
+
+# The commands are run through sh, and the pipes are read with selectors which do not support pipes on Windows
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Requires a POSIX shell and selectable pipes")
+
+
+def test_command_run_yields_lines():
+    assert list(Command("printf 'a\\nb\\nc\\n'").run()) == ["a", "b", "c"]
+
+
+def test_command_run_yields_last_line_without_newline():
+    assert list(Command("printf 'a\\nb'").run()) == ["a", "b"]
+
+
+def test_command_run_universal_newlines():
+    assert list(Command("printf 'a\\r\\nb\\rc\\r\\n\\r\\nd\\r'").run()) == ["a", "b", "c", "", "d"]
+
+
+def test_command_run_binary_mode():
+    assert list(CommandBinaryMode("printf 'a\\nb\\n'").run()) == ["a", "b"]
+
+
+def test_command_run_does_not_yield_stderr():
+    out = StringIO()
+    assert list(Command("echo out; echo err >&2").run(stdout=out)) == ["out"]
+    assert "err" in out.getvalue()
+
+
+def test_command_run_does_not_wait_for_background_children():
+    start = time.monotonic()
+    assert list(Command("echo hi; printf last; sleep 3 &").run()) == ["hi", "last"]
+    assert time.monotonic() - start < 2
+
+
+def test_command_run_raises_on_error():
+    with pytest.raises(subprocess.CalledProcessError):
+        list(Command("echo failing; exit 3").run())
+
+
+def test_command_run_without_shell():
+    @dataclass
+    class Printf(Command):
+        shell: bool = field(init=False, default=False)
+
+    cmd = Printf("printf '%s\\n' 'a b' {name}")
+    assert cmd.prepare_cmd(name="c") == ["printf", "%s\\n", "a b", "c"]
+    assert list(cmd.run(name="c")) == ["a b", "c"]
+
+
+def test_create_args():
+    cmd = Command("echo")
+    assert cmd.create_args({"--title": "a b", "-v": None}, "c d") == "--title='a b' -v 'c d'"
+    assert cmd.create_argv({"--title": "a b", "-v": None}, "c d") == ["--title=a b", "-v", "c d"]
+
+
+def test_piped_commands_run():
+    assert list((Command("printf 'a\\nb\\n'") | Command("tr a-z A-Z")).run()) == ["A", "B"]
+    assert list((CommandBinaryMode("printf 'a\\nb'") | CommandBinaryMode("tr a-z A-Z")).run()) == ["A", "B"]
+
+
+def test_piped_commands_run_universal_newlines():
+    assert list((Command("printf 'a\\r\\nb\\rc'") | Command("cat")).run()) == ["a", "b", "c"]
+
+
+def test_piped_commands_run_binary_mode():
+    piped = CommandBinaryMode("printf 'a\\r\\nb\\rc'") | CommandBinaryMode("cat")
+    assert list(piped.run()) == ["a\r", "b\rc"]
+
+
+def test_sequential_commands_run():
+    converter = StdinConverter(target=Command(...), converter=lambda out: {"cmd": f"echo converted {out}"})
+    process = SequentialProcessRunner(Command("echo a"), Command("echo b"), converter)
+
+    assert list(process.run()) == ["a", "b", "converted b"]
+
+
+def test_sequential_commands_run_with_iterable_converter():
+    converter = StdinConverter(
+        target=Command(...), converter=lambda lines: {"cmd": f"echo {len(lines)} lines"}, accepts_iterable=True
+    )
+    process = SequentialProcessRunner(Command("printf 'a\\nb\\n'"), converter)
+
+    assert list(process.run()) == ["a", "b", "2 lines"]
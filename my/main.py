@@ -8,44 +8,46 @@ import subprocess
 import sys
 from argparse import ArgumentParser
 from pathlib import Path
-from typing import Union
-
-try:
-    from notify2 import Notification, init
-
-    NOTIFY2_AVAILABLE = True
-except ImportError:
-    NOTIFY2_AVAILABLE = False
-
+from typing import Dict, List, Optional, Union
 
 from my.commands import (HIDDEN_ARGUMENT, OPTIONAL_ARGUMENT, REQUIRED_ARGUMENT,
                          Command, CommandBinaryMode, Print,
                          SequentialProcessRunner, StdinConverter)
-from my.plugins import PluginLoader, loader
+from my.plugins import (ENTRY_POINTS_ENV, PluginLoader, entry_points_manifest,
+                        loader)
 
 logger = logging.getLogger(__name__)
 
+# Number of output lines of a process written at once
+OUTPUT_BATCH_SIZE = 64
 
-_notify_init = False
+
+# notify2 is only imported when the first notification is sent: None until then, False if it is not installed
+_notify2 = None
 
 
 def send_notification(*args, **kwargs):
-    global _notify_init
+    global _notify2
 
-    if not NOTIFY2_AVAILABLE:
+    if _notify2 is None:
+        try:
+            import notify2
+        except ImportError:
+            _notify2 = False
+        else:
+            new_env = {
+                "DISPLAY": ":0",
+                "DBUS_SESSION_BUS_ADDRESS": "unix:path=/run/user/1000/bus",
+            }
+            os.environ.update(new_env)
+            notify2.init("my-yeti")
+            _notify2 = notify2
+
+    if not _notify2:
         print(args, kwargs)
         return
 
-    if not _notify_init:
-        new_env = {
-            "DISPLAY": ":0",
-            "DBUS_SESSION_BUS_ADDRESS": "unix:path=/run/user/1000/bus",
-        }
-        os.environ.update(new_env)
-        init("my-yeti")
-        _notify_init = True
-
-    Notification(*args, **kwargs).show()
+    _notify2.Notification(*args, **kwargs).show()
 
 
 def run_process(process, args):
@@ -63,9 +65,19 @@ def run_process(process, args):
         debug_file_context = contextlib.nullcontext(sys.stderr)
 
     with open_file_context as f, debug_file_context as debug_out:
+        write = f.write
+        # Lines are written by batches, except on a terminal where they are shown as soon as they are produced
+        batch_size = 1 if f.isatty() else OUTPUT_BATCH_SIZE
+        lines: List[str] = []
         try:
-            for l in process.prepare(**args_dict).run(stdin=sys.stdin, stdout=debug_out, **args_dict):
-                print(prefix, l, sep="", file=f)
+            try:
+                for l in process.prepare(**args_dict).run(stdin=sys.stdin, stdout=debug_out, **args_dict):
+                    lines.append(f"{prefix}{l}\n")
+                    if len(lines) >= batch_size:
+                        write("".join(lines))
+                        lines.clear()
+            finally:
+                write("".join(lines))
         except KeyboardInterrupt:
             pass
         except Exception as e:
@@ -77,12 +89,35 @@ def run_process(process, args):
                 send_notification(summary=args.function_name, message=f"Process {args.function_name} was successful.")
 
 
+def background_env() -> Dict[str, str]:
+    """Environment of the background processes, with the plugins entrypoints found by this process so the child does
+    not look them up again"""
+    return dict(os.environ, **{ENTRY_POINTS_ENV: entry_points_manifest()})
+
+
+def spawn_background(new_args: List[str], output_file: Optional[Path] = None) -> int:
+    """Start `new_args` without waiting for it, with stdin from /dev/null and its output appended to `output_file`.
+
+    The streams are opened by the child itself so this process is never forked.
+    """
+    file_actions = [(os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0)]
+    if output_file:
+        file_actions.append((os.POSIX_SPAWN_OPEN, 1, str(output_file), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666))
+        file_actions.append((os.POSIX_SPAWN_DUP2, 1, 2))
+
+    return os.posix_spawnp(new_args[0], new_args, background_env(), file_actions=file_actions)
+
+
 def run_process_cli(args):
     if not args.background:
         process = args.retrieve_func(args.function_name)
         run_process(process, args)
     else:
         new_args = [arg for arg in sys.orig_argv if arg not in ["--bg", "--background"]]
+        if hasattr(os, "posix_spawnp"):
+            spawn_background(new_args, getattr(args, "output_file", None))
+            return
+
         std_redir = {"stdin": subprocess.DEVNULL}
         if getattr(args, "output_file", None):
             out = args.output_file.open("a")
@@ -93,10 +128,23 @@ def run_process_cli(args):
                 }
             )
 
-        sub = subprocess.Popen(new_args, **std_redir)
+        # The standard streams are redirected explicitly, not closing the other descriptors lets Popen use
+        # posix_spawn instead of forking this process
+        sub = subprocess.Popen(new_args, close_fds=False, env=background_env(), **std_redir)
+
 
+def _sniff_subcommand(argv: List[str]) -> Optional[str]:
+    """The first positional argument of the command line, if any. The top-level options are all flags so there
+    are no option values to skip"""
+    for arg in argv:
+        if not arg.startswith("-"):
+            return arg
+    return None
 
-def create_argument_parser(plugin_loader: PluginLoader) -> ArgumentParser:
+
+def create_argument_parser(
+    plugin_loader: PluginLoader, argv: Optional[List[str]] = None, defer_process_arguments: bool = False
+) -> ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Manage processes", formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
@@ -137,11 +185,23 @@ def create_argument_parser(plugin_loader: PluginLoader) -> ArgumentParser:
         help="Where to print the intermediate steps",
     )
 
+    # With the command line to parse in `argv`, only the plugins exposing the requested process need their
+    # arguments, unless the help is asked or the process is not known, so argparse can list every choice
+    plugins = list(plugin_loader.plugins.values())
+    subcommand = _sniff_subcommand(argv) if argv is not None else None
+    if subcommand is not None and not any(arg in ("-h", "--help") for arg in argv):
+        plugins = plugin_loader.plugins_for_subcommand(subcommand) or plugins
+
     # run_parser = subparsers.add_parser("run", help="Run processes")
     # process_subparsers = parser.add_subparsers(dest="name", metavar="command")
-    for plug_name, plug in plugin_loader.plugins.items():
+    for plug in plugins:
         # process_parser = process_subparsers.add_parser(plug_name, parents=[process_config_parser])
-        plug.add_arguments(parser, process_parser_kwargs={"parents": [process_config_parser]}, add_all_fields=True)
+        plug.add_arguments(
+            parser,
+            process_parser_kwargs={"parents": [process_config_parser]},
+            defer_process_arguments=defer_process_arguments,
+            add_all_fields=True,
+        )
 
     parser.set_defaults(func=run_process_cli)
 
@@ -149,14 +209,23 @@ def create_argument_parser(plugin_loader: PluginLoader) -> ArgumentParser:
 
 
 def main():
-    parser = create_argument_parser(plugin_loader=loader)
+    argv = sys.argv[1:]
 
-    args = parser.parse_args()
-    if args.debug:
+    # --debug is a top-level flag, it is checked before building the parser so the shell opens right away
+    subcommand = _sniff_subcommand(argv)
+    if "--debug" in (argv[: argv.index(subcommand)] if subcommand is not None else argv):
         import ipdb
 
         ipdb.set_trace()
 
+    parser = create_argument_parser(plugin_loader=loader, argv=argv, defer_process_arguments=True)
+
+    # Find the selected process first, without the help flags that would exit before its arguments are added
+    known_args, _ = parser.parse_known_args([arg for arg in argv if arg not in ("-h", "--help")])
+    if add_process_arguments := getattr(known_args, "add_process_arguments", None):
+        add_process_arguments()
+
+    args = parser.parse_args(argv)
     args.func(args)
 
 
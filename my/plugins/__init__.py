@@ -1,28 +1,51 @@
+import json
 import logging
-import sys
+import os
+from functools import lru_cache
 
+from ._meta import EntryPoint, EntryPoints, entry_points
 from .common import *  # noqa
 from .load import *  # noqa
 from .load import PluginLoader
 
-if sys.version_info < (3, 10):
-    from importlib_metadata import EntryPoint, entry_points
-else:
-    from importlib.metadata import EntryPoint, entry_points
-
 logger = logging.getLogger(__name__)
 
 
+# Environment variable holding the plugins entrypoints, set for the processes started in the background so they
+# don't read the metadata of every installed distribution again
+ENTRY_POINTS_ENV = "MY_YETI_ENTRY_POINTS"
+PLUGIN_GROUPS = ("my.plugins.command", "my.plugins.process", "my.plugins.registry")
+
+
+@lru_cache(maxsize=None)
+def all_entry_points():
+    """All the installed entrypoints. Reading them parses the metadata of every installed distribution, so it is
+    only done once"""
+    manifest = os.environ.pop(ENTRY_POINTS_ENV, None)
+    if manifest:
+        return EntryPoints(EntryPoint(name, value, group) for name, value, group in json.loads(manifest))
+    return entry_points()
+
+
+def entry_points_manifest() -> str:
+    """The plugins entrypoints, serialized for `ENTRY_POINTS_ENV`"""
+    _all_entrypoints = all_entry_points()
+    return json.dumps(
+        [(ep.name, ep.value, ep.group) for group in PLUGIN_GROUPS for ep in _all_entrypoints.select(group=group)]
+    )
+
+
 def load_plugins(loader: PluginLoader):
-    for _plug_entrypoint in entry_points(group="my.plugins.command"):
+    _all_entrypoints = all_entry_points()
+    for _plug_entrypoint in _all_entrypoints.select(group="my.plugins.command"):
         logger.info("loading command %s", _plug_entrypoint)
         loader.load_command(_plug_entrypoint)
 
-    for _plug_entrypoint in entry_points(group="my.plugins.process"):
+    for _plug_entrypoint in _all_entrypoints.select(group="my.plugins.process"):
         logger.info("loading process %s", _plug_entrypoint)
         loader.load_process(_plug_entrypoint)
 
-    for _plug_entrypoint in entry_points(group="my.plugins.registry"):
+    for _plug_entrypoint in _all_entrypoints.select(group="my.plugins.registry"):
         logger.info("loading registry %s", _plug_entrypoint)
         loader.load_registry(_plug_entrypoint)
 
@@ -2,8 +2,9 @@ import logging
 import sys
 from argparse import ArgumentParser
 from collections import defaultdict
-from dataclasses import dataclass, field
-from typing import (Any, Dict, Generic, List, Optional, Tuple, Type, TypeVar,
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import (Callable, Iterator, List, Optional, Tuple, Type, TypeVar,
                     Union)
 
 from my.commands import ProcessRunner
@@ -13,8 +14,21 @@ TProcessRunner = TypeVar("TProcessRunner", bound="ProcessRunner")
 logger = logging.getLogger(__name__)
 
 
-@dataclass
-class ExternalCommand:
+@lru_cache(maxsize=None)
+def split_export_path(export_path: str) -> Tuple[str, ...]:
+    """Parts of an export path. Many items share the same export path so it is only split once"""
+    return tuple(export_path.split(".")) if export_path else ()
+
+
+class ExportedItemRepr:
+    """Represents an exposed item by its type and full path, eg. `<ExternalCommand notes.NewNote>`"""
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {'.'.join(filter(None, (self.export_path, self.name)))}>"
+
+
+@dataclass(repr=False)
+class ExternalCommand(ExportedItemRepr):
     cls: Type[TProcessRunner]
     name: str = ""
     export_path: str = ""
@@ -25,26 +39,53 @@ class ExternalCommand:
             self.name = self.cls.__name__
         self.module = self.cls.__module__
 
+    @property
+    def hierarchy(self) -> Tuple[str, ...]:
+        return split_export_path(self.export_path or "")
+
 
-@dataclass
-class ExternalProcess:
+@dataclass(repr=False)
+class ExternalProcess(ExportedItemRepr):
     name: str
     process: TProcessRunner
     export_path: str = ""
 
+    @property
+    def hierarchy(self) -> Tuple[str, ...]:
+        return split_export_path(self.export_path or "")
 
-@dataclass
+    def resolved(self) -> "ExternalProcess":
+        """Returns the process with its factory called, if it was registered with a factory instead of an instance"""
+        if not isinstance(self.process, ProcessRunner) and callable(self.process):
+            return replace(self, process=self.process())
+        return self
+
+
+@dataclass(repr=False)
 class PluginRegistry:
     name: Optional[str] = None
     commands: List[ExternalCommand] = field(default_factory=list, init=False)
     processes: List[ExternalProcess] = field(default_factory=list, init=False)
     # Register other types (processes, ...)
 
+    def __repr__(self) -> str:
+        return f"<PluginRegistry {self.name or ''}: commands={len(self.commands)}, processes={len(self.processes)}>"
+
+    def __iter__(self) -> Iterator[ExternalCommand]:
+        return iter(self.commands)
+
     def _register(self, command: ExternalCommand) -> Type[TProcessRunner]:
         self.commands.append(command)
         return command.cls
 
-    def add_process(self, name: str, process: TProcessRunner, export_path: str = ""):
+    def add_process(
+        self, name: str, process: Union[TProcessRunner, Callable[[], TProcessRunner]], export_path: str = ""
+    ):
+        """Add a process to the registry.
+
+        `process` can also be a function without arguments creating the process, so it is only created when it is
+        first used (ie. when it is selected on the command line) and not when the module defining it is imported.
+        """
         self.processes.append(ExternalProcess(name=name, process=process, export_path=export_path))
 
     def register(self, *args, **kwargs):
@@ -1,42 +1,115 @@
 import logging
 import sys
 from argparse import ArgumentParser, _SubParsersAction
-from collections import defaultdict
 from dataclasses import dataclass, field
-from io import StringIO
-from typing import (Any, Callable, Dict, Generator, Generic, List, Optional,
-                    Tuple, Type, TypeVar)
+from functools import cached_property, lru_cache, partial
+from types import MappingProxyType
+from typing import (Any, Dict, List, Mapping, Optional, Set, Tuple, Type,
+                    TypeVar, Union)
 
 from my.commands import ProcessRunner
-from my.plugins.common import ExternalCommand, ExternalProcess, PluginRegistry
+from my.plugins._meta import EntryPoint
+from my.plugins.common import (ExportedItemRepr, ExternalCommand,
+                               ExternalProcess, PluginRegistry)
 from my.utils import AttrTree, AttrTreeConfig
 
-if sys.version_info < (3, 10):
-    from importlib_metadata import EntryPoint, entry_points
-else:
-    from importlib.metadata import EntryPoint, entry_points
-
 TProcessRunner = TypeVar("TProcessRunner", bound="ProcessRunner")
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def _split_entrypoint_name(ep_name: str) -> Tuple[str, Tuple[str, ...]]:
+    *hierarchy, name = ep_name.split("__")
+    return sys.intern(name), tuple(sys.intern(h) for h in hierarchy)
+
+
+@dataclass(repr=False)
+class LazyExternalCommand(ExportedItemRepr):
+    """An ExternalCommand whose class is only imported from its entrypoint when it is first accessed"""
+
+    entrypoint: EntryPoint
+    name: str
+    hierarchy: Tuple[str, ...] = ()
+
+    @property
+    def module(self) -> str:
+        return self.entrypoint.module
+
+    @cached_property
+    def export_path(self) -> str:
+        return ".".join(self.hierarchy)
+
+    @cached_property
+    def cls(self) -> Type[TProcessRunner]:
+        cls = self.entrypoint.load()
+        if not issubclass(cls, ProcessRunner):
+            logger.warn(f"Class {cls} is not a subclass of ProcessRunner")
+        return cls
+
+
+@dataclass(repr=False)
+class LazyExternalProcess(ExportedItemRepr):
+    """An ExternalProcess whose process is only imported from its entrypoint when it is first accessed"""
+
+    entrypoint: EntryPoint
+    name: str
+    hierarchy: Tuple[str, ...] = ()
+
+    @cached_property
+    def export_path(self) -> str:
+        return ".".join(self.hierarchy)
+
+    @cached_property
+    def process(self) -> TProcessRunner:
+        process = self.entrypoint.load()
+        if not isinstance(process, ProcessRunner):
+            logger.warn(f"Process {process} is not an instance of ProcessRunner")
+        return process
+
+
+@dataclass(repr=False)
+class LazyRegistryProcess(ExportedItemRepr):
+    """A process of a registry, only created by its factory when it is first accessed"""
+
+    registered: ExternalProcess
+
+    @property
+    def name(self) -> str:
+        return self.registered.name
+
+    @property
+    def export_path(self) -> str:
+        return self.registered.export_path
+
+    @property
+    def hierarchy(self) -> Tuple[str, ...]:
+        return self.registered.hierarchy
+
+    @cached_property
+    def process(self) -> TProcessRunner:
+        return self.registered.resolved().process
+
+
+# Shared by the trees of all the plugins
+_COMMANDS_CONFIG = AttrTreeConfig(expose_leafs_items=True, item_name="name", item_value="cls")
+_PROCESSES_CONFIG = AttrTreeConfig(expose_leafs_items=False, item_name="name", item_value="process")
+
+
 @dataclass
 class Plugin:
     name: str
     module: str  # TODO Is not really the expected module path, see what we can do about it
     commands: AttrTree[ExternalCommand] = field(
-        default_factory=lambda: AttrTree[ExternalCommand](
-            config=AttrTreeConfig(expose_leafs_items=True, item_name=lambda x: x.name, item_value=lambda x: x.cls),
-        ),
-        init=False,
+        default_factory=lambda: AttrTree[ExternalCommand](config=_COMMANDS_CONFIG), init=False
     )
     processes: AttrTree[ExternalProcess] = field(
-        default_factory=lambda: AttrTree[ExternalProcess](
-            config=AttrTreeConfig(expose_leafs_items=False, item_name=lambda x: x.name, item_value=lambda x: x.process),
-        ),
-        init=False,
+        default_factory=lambda: AttrTree[ExternalProcess](config=_PROCESSES_CONFIG), init=False
     )
+    # Cache of `as_dict`, cleared when a command or process is added
+    _as_dict: Optional[Mapping[str, Any]] = field(default=None, init=False, repr=False, compare=False)
+    # First part of the path of every process, ie. the subcommands this plugin adds to the root parser
+    _subcommands: Set[str] = field(default_factory=set, init=False, repr=False, compare=False)
 
     def __str__(self) -> str:
         return f"<Plugin {self.name}: commands={len(self.commands)}, processes={len(self.processes)}>"
@@ -56,93 +129,118 @@ class Plugin:
     #     dc = self.commands.__dir__()
     #     return d + dp + dc
 
-    def add_command(self, cmd: ExternalCommand):
-        self.commands.add_item(cmd, path=".".join(self.hierarchy_for_command(cmd)))
-
-    def add_process(self, process: ExternalProcess):
-        self.processes.add_item(process, path=".".join(self.hierarchy_for_process(process)))
+    def add_command(self, cmd: Union[ExternalCommand, LazyExternalCommand]):
+        self._as_dict = None
+        self.commands.add_item(cmd, path=cmd.export_path or "")
+
+    def add_process(self, process: Union[ExternalProcess, LazyExternalProcess, LazyRegistryProcess]):
+        self._as_dict = None
+        hierarchy = process.hierarchy
+        self._subcommands.add(hierarchy[0] if hierarchy else process.name)
+        self.processes.add_item(process, path=process.export_path or "")
+
+    def exposes_subcommand(self, name: str) -> bool:
+        """Whether `name` is the first part of the path of one of the processes of this plugin"""
+        return name in self._subcommands
+
+    def all_commands(self) -> Mapping[str, ExternalCommand]:
+        return self.as_dict()["commands"]
+
+    def as_dict(self) -> Mapping[str, Any]:
+        """The plugin content. The result is cached, so it is read-only"""
+        if self._as_dict is None:
+            self._as_dict = MappingProxyType(
+                {
+                    "module": self.module,
+                    "commands": MappingProxyType(self.commands.as_dict()),
+                    "processes": MappingProxyType(self.processes.as_dict()),
+                }
+            )
+        return self._as_dict
+
+    def add_arguments(
+        self,
+        parser: ArgumentParser,
+        process_parser_kwargs: Dict[str, Any] = {},
+        defer_process_arguments: bool = False,
+        **kwargs,
+    ):
+        """Add a parser for every process of this plugin.
+
+        With `defer_process_arguments`, the arguments of a process are not added to its parser. Instead, the parser
+        gets an `add_process_arguments` default to call once the command line selected this process, so only the
+        selected process is loaded.
+        """
+        if not self.processes:
+            # Only commands, there is nothing to run
+            return
 
-    def hierarchy_for_process(self, process: ExternalProcess) -> List[str]:
-        path = process.export_path or ""
-        return path.split(".")
-
-    def hierarchy_for_command(self, cmd: ExternalCommand) -> List[str]:
-        path = cmd.export_path or ""
-        return path.split(".")
-
-    def all_commands(self) -> Dict[str, ExternalCommand]:
-        return self.commands.as_dict()
-
-    def as_dict(self) -> Dict[str, Any]:
-        return {"module": self.module, "commands": self.commands.as_dict(), "processes": self.processes.as_dict()}
-
-    def add_arguments(self, parser: ArgumentParser, process_parser_kwargs: Dict[str, Any] = {}, **kwargs):
         parser.set_defaults(retrieve_func=lambda func_name: self.processes[func_name], function_name=self.name)
 
         parsers_sub: Dict[str, _SubParsersAction] = {"": parser.add_subparsers(title="actions")}
 
-        def get_or_create_module_parser(path: str) -> _SubParsersAction:
-            if path not in parsers_sub:
-                *parents, parser_name = path.rsplit(".", 1)
-                parent_parser = get_or_create_module_parser(parents[0] if parents else "")
-
-                this_parser = parent_parser.add_parser(parser_name, **process_parser_kwargs)
-                this_parser.set_defaults(function_name=path)
-
-                parsers_sub[path] = this_parser.add_subparsers(title=parser_name)
+        for process_path in self.processes.paths():
+            *parents, process_name = process_path.split(".")
+            # Walk down the module parsers of the process, creating the missing ones
+            this_parser = parsers_sub[""]
+            path = ""
+            for parser_name in parents:
+                path = f"{path}.{parser_name}" if path else parser_name
+                if path not in parsers_sub:
+                    module_parser = this_parser.add_parser(parser_name, **process_parser_kwargs)
+                    module_parser.set_defaults(function_name=path)
+                    parsers_sub[path] = module_parser.add_subparsers(title=parser_name)
+                this_parser = parsers_sub[path]
 
-            return parsers_sub[path]
-
-        for process_path, process in self.processes.as_list():
-            *parent, process_name = process_path.rsplit(".", 1)
-            this_parser = get_or_create_module_parser(parent[0] if parent else "")
             process_parser = this_parser.add_parser(process_name, **process_parser_kwargs)
             process_parser.set_defaults(function_name=process_path)
-            process.add_arguments(process_parser, **kwargs)
+            add_process_arguments = partial(self._add_process_arguments, process_path, process_parser, **kwargs)
+            if defer_process_arguments:
+                process_parser.set_defaults(add_process_arguments=add_process_arguments)
+            else:
+                add_process_arguments()
+
+    def _add_process_arguments(self, process_path: str, parser: ArgumentParser, **kwargs):
+        self.processes.get_item(process_path).add_arguments(parser, **kwargs)
 
 
 @dataclass
 class PluginLoader:
     plugins: Dict[str, Plugin] = field(init=False, default_factory=dict)
 
-    def plugin_name(self, module: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def plugin_name(module: str) -> str:
         return module.split(".")[0]
 
+    def plugins_for_subcommand(self, name: str) -> List[Plugin]:
+        return [plug for plug in self.plugins.values() if plug.exposes_subcommand(name)]
+
     def get_or_create_plugin_for_module(self, module: str) -> Plugin:
         plug_name = self.plugin_name(module)
         if plug_name not in self.plugins:
             self.plugins[plug_name] = Plugin(name=plug_name, module=module)
         return self.plugins[plug_name]
 
-    def get_name_and_hierarchy_from_entrypoint(self, ep: EntryPoint) -> Tuple[str, List[str]]:
-        *hierarchy, name = ep.name.split("__")
-        return name, hierarchy
+    def get_name_and_hierarchy_from_entrypoint(self, ep: EntryPoint) -> Tuple[str, Tuple[str, ...]]:
+        return _split_entrypoint_name(ep.name)
 
     def load_command(self, cmd_entrypoint: EntryPoint):
         plugin = self.get_or_create_plugin_for_module(cmd_entrypoint.module)
-        cls = cmd_entrypoint.load()
-        if not issubclass(cls, ProcessRunner):
-            logger.warn(f"Class {cls} is not a subclass of ProcessRunner")
-            # raise ValueError(f"Class {cls} is not a subclass of ProcessRunner. Did not load")
 
         # Split the entrypoint name into plugin name, hierarchy.
         # Eg. google__user__authenticate pointing to GoogleAuthentication becomes "authenticate, ['google', 'user']"
         # and will be exposed as plugins.google.user.GoogleAuthentication
         command_name, hierarchy = self.get_name_and_hierarchy_from_entrypoint(cmd_entrypoint)
-        export_path = ".".join(hierarchy)
-        cmd = ExternalCommand(cls, name=command_name, export_path=export_path)
+        # The class is only imported when the command is accessed
+        cmd = LazyExternalCommand(cmd_entrypoint, name=command_name, hierarchy=hierarchy)
         plugin.add_command(cmd)
 
     def load_process(self, proc_entrypoint: EntryPoint):
         plugin = self.get_or_create_plugin_for_module(proc_entrypoint.module)
-        process = proc_entrypoint.load()
-        if not isinstance(process, ProcessRunner):
-            logger.warn(f"Process {process} is not an instance of ProcessRunner. Did not load")
-
         process_name, hierarchy = self.get_name_and_hierarchy_from_entrypoint(proc_entrypoint)
-
-        export_path = ".".join(hierarchy)
-        proc = ExternalProcess(name=process_name, process=process, export_path=export_path)
+        # The process is only imported when it is accessed
+        proc = LazyExternalProcess(proc_entrypoint, name=process_name, hierarchy=hierarchy)
 
         plugin.add_process(proc)
 
@@ -161,46 +259,48 @@ class PluginLoader:
         # - PluginRegister() exposed with google__auth is "google"
         # - PluginRegister() exposed with auth is ""
         if registry.name:
-            hierarchy.append(registry.name)
+            hierarchy += (registry.name,)
         base_export_path = ".".join(hierarchy)
 
-        for command in registry.commands:
-            command.export_path = command.export_path or base_export_path
-            plugin.add_command(command)
+        # The registered commands are left untouched, the plugin gets its own copy with the resolved export path
+        for command in registry:
+            plugin.add_command(
+                ExternalCommand(command.cls, name=command.name, export_path=command.export_path or base_export_path)
+            )
 
         for process in registry.processes:
             # TODO
             # process.export_path =
-            plugin.add_process(process)
+            # Processes registered with a factory are only created when they are accessed
+            plugin.add_process(LazyRegistryProcess(process))
 
     def processes_tree(self) -> str:
-        out = StringIO()
+        lines: List[str] = []
         # chars = "│├└─"
         chars = "    "
 
+        indents: List[str] = []
+
         def indent(depth: int) -> str:
-            return f"{chars[0]}  " * depth
+            while len(indents) <= depth:
+                indents.append(f"{chars[0]}  " * len(indents))
+            return indents[depth]
 
         def print_group(grp, depth: int):
             # Print name
             if depth != 0:
-                print(indent(depth), " ", grp["name"], sep="", file=out)
+                lines.append(f"{indent(depth)} {grp['name']}")
             # Print items
             last_item_num = len(grp["items"])
-            for i, item in enumerate(grp["items"], start=1):
-                print(indent(depth), chars[2] if last_item_num else chars[1], chars[3] * 2, " ", item, sep="", file=out)
+            item_prefix = indent(depth) + (chars[2] if last_item_num else chars[1]) + chars[3] * 2 + " "
+            lines.extend(item_prefix + item for item in grp["items"])
 
             # Print subgroups
-            for k, val in grp.items():
-                if k in ["name", "items"]:
-                    continue
-
-                print_group(val, depth + 1)
+            for sub_grp in grp["groups"].values():
+                print_group(sub_grp, depth + 1)
 
         for plug_name, plug in self.plugins.items():
-            print(plug.name, file=out)
-            proc_dict = plug.processes.as_dict()
-
-            print_group(proc_dict, depth=0)
+            lines.append(plug.name)
+            print_group(plug.processes.as_tree(), depth=0)
 
-        return out.getvalue()
+        return "".join(line + "\n" for line in lines)
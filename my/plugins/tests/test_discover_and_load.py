@@ -1,5 +1,4 @@
 import argparse
-import sys
 from dataclasses import dataclass
 from typing import Any, Dict, List, Set
 
@@ -7,12 +6,9 @@ import pytest
 
 from my.commands import Command
 from my.commands.tests.test_arguments import check_action_attributes
-from my.plugins.load import ExternalProcess, Plugin, PluginLoader
-
-if sys.version_info < (3, 10):
-    from importlib_metadata import EntryPoint
-else:
-    from importlib.metadata import EntryPoint
+from my.plugins._meta import EntryPoint
+from my.plugins.load import (ExternalCommand, ExternalProcess, Plugin,
+                             PluginLoader, PluginRegistry)
 
 
 def this_is_a_function():
@@ -64,6 +60,80 @@ def test_process_tree_example():
     assert check_action_attributes(expected_arguments, parser._actions, excluded=set(["help"]))
 
 
+def test_plugin_defers_process_arguments():
+    @dataclass
+    class A(Command):
+        i: int
+
+    plug = Plugin("test_plug", "my.test")
+    plug.add_process(ExternalProcess("world", process=A(i=..., cmd="None"), export_path="hello"))
+
+    parser = argparse.ArgumentParser()
+    plug.add_arguments(parser, defer_process_arguments=True, add_all_fields=True)
+
+    args = parser.parse_args(["hello", "world"])
+    assert args.function_name == "hello.world"
+
+    args.add_process_arguments()
+    assert parser.parse_args(["hello", "world", "3"]).i == "3"
+
+
+def test_plugin_without_processes_adds_no_subparsers():
+    plug = Plugin("test_plug", "my.test")
+    plug.add_command(ExternalCommand(Command))
+
+    parser = argparse.ArgumentParser()
+    plug.add_arguments(parser, add_all_fields=True)
+    assert parser._subparsers is None
+    assert parser.get_default("retrieve_func") is None
+
+
+def test_plugin_exposes_subcommand():
+    plug = Plugin("test_plug", "my.test")
+    plug.add_process(ExternalProcess("world", process=Command("echo 'world'"), export_path="hello"))
+    plug.add_process(ExternalProcess("plain", process=Command("echo 'plain'"), export_path=""))
+
+    assert plug.exposes_subcommand("hello")
+    assert plug.exposes_subcommand("plain")
+    assert not plug.exposes_subcommand("world")
+
+    loader = PluginLoader()
+    loader.plugins[plug.name] = plug
+    assert loader.plugins_for_subcommand("hello") == [plug]
+    assert loader.plugins_for_subcommand("world") == []
+
+
+def test_plugin_as_dict_is_updated_when_adding_items():
+    plug = Plugin("test_plug", "my.test")
+    plug.add_process(ExternalProcess("plain", process=Command("echo 'plain'"), export_path=""))
+    assert plug.as_dict() is plug.as_dict()
+    assert list(plug.as_dict()["processes"]) == ["plain"]
+
+    plug.add_process(ExternalProcess("world", process=Command("echo 'world'"), export_path="hello"))
+    assert list(plug.as_dict()["processes"]) == ["plain", "hello.world"]
+
+
+def test_plugin_commands_are_read_only():
+    plug = Plugin("test_plug", "my.test")
+    plug.add_command(ExternalCommand(Command))
+
+    with pytest.raises(TypeError):
+        plug.all_commands()["Other"] = Command
+    with pytest.raises(TypeError):
+        plug.as_dict()["commands"] = {}
+    assert list(plug.all_commands()) == ["Command"]
+
+
+def test_processes_tree():
+    plug = Plugin("test_plug", "my.test")
+    plug.add_process(ExternalProcess("world", process=Command("echo 'world'"), export_path="hello"))
+    plug.add_process(ExternalProcess("plain", process=Command("echo 'plain'"), export_path=""))
+
+    loader = PluginLoader()
+    loader.plugins[plug.name] = plug
+    assert loader.processes_tree().splitlines() == ["test_plug", "    plain", "    hello", "       world"]
+
+
 def test_entrypoint_creation():
     e = expose_as_entrypoint("name", "my.group", this_is_a_function)
     fn = e.load()
@@ -82,3 +152,74 @@ def test_plugin_loader_command():
 
     assert "test_discover_and_load" in p.plugins
     assert p.plugins["test_discover_and_load"].commands.as_list() == [("Printer", A)]
+
+
+def test_plugin_loader_defers_entrypoint_loading():
+    cmd_entrypoint = EntryPoint(name="Lazy", group="my.plugins.command", value=f"{__name__}:LazyCommand")
+    proc_entrypoint = EntryPoint(name="tools__lazy", group="my.plugins.process", value=f"{__name__}:lazy_process")
+
+    p = PluginLoader()
+    # Nothing is imported yet, so the entrypoints can point to objects that do not exist yet
+    p.load_command(cmd_entrypoint)
+    p.load_process(proc_entrypoint)
+
+    @dataclass
+    class LazyCommand(Command):
+        pass
+
+    globals()["LazyCommand"] = LazyCommand
+    globals()["lazy_process"] = Command("echo 'lazy'")
+
+    plugin = p.plugins["test_discover_and_load"]
+    assert plugin.commands.as_list() == [("Lazy", LazyCommand)]
+    assert plugin.processes["tools.lazy"] == Command("echo 'lazy'")
+
+
+def test_plugin_loader_registry_does_not_modify_commands():
+    registry = PluginRegistry("registered")
+
+    @registry.register
+    @dataclass
+    class B(Command):
+        pass
+
+    globals()["commands_registry"] = registry
+    registry_entrypoint = EntryPoint(
+        name="tools__commands_registry", group="my.plugins.registry", value=f"{__name__}:commands_registry"
+    )
+
+    p = PluginLoader()
+    p.load_registry(registry_entrypoint)
+
+    assert [cmd.export_path for cmd in registry] == [""]
+    assert p.plugins["test_discover_and_load"].commands.as_list() == [("tools.registered.B", B)]
+
+
+def test_plugin_loader_registry_with_process_factory():
+    created = []
+
+    def create_process(name):
+        def create():
+            created.append(name)
+            return Command(f"echo '{name}'")
+
+        return create
+
+    registry = PluginRegistry()
+    registry.add_process("created", create_process("created"), export_path="lazy")
+    registry.add_process("unused", create_process("unused"), export_path="lazy")
+    assert not created
+
+    globals()["factory_registry"] = registry
+    registry_entrypoint = EntryPoint(
+        name="factory_registry", group="my.plugins.registry", value=f"{__name__}:factory_registry"
+    )
+
+    p = PluginLoader()
+    p.load_registry(registry_entrypoint)
+    assert not created
+
+    plugin = p.plugins["test_discover_and_load"]
+    assert plugin.processes["lazy.created"] == Command("echo 'created'")
+    assert plugin.processes["lazy.created"] == Command("echo 'created'")
+    assert created == ["created"]
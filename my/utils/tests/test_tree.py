@@ -1,4 +1,5 @@
 import argparse
+import copy
 from dataclasses import dataclass
 from typing import Any, Dict, List, Set
 
@@ -146,3 +147,58 @@ def test_retrieve_dog_only_with_name_does_not_work_with_duplicates(duplicate_dog
     duplicate_names = [d.name for d in additional_dogs]
     for dog in duplicate_dogs:
         assert dog.name in duplicate_names or getattr(dog_tree, dog.name) == dog
+
+
+def test_as_list_after_adding_items(simple_dogs, additional_dogs):
+    dog_tree = create_dog_tree(simple_dogs)
+    assert len(dog_tree.as_list()) == len(simple_dogs)
+
+    for dog in additional_dogs:
+        dog_tree.add_item(dog, ".".join(dog.race_hierarchy))
+    assert dog_tree.as_dict() == {dog.full_name: dog for dog in simple_dogs + additional_dogs}
+
+
+def test_module_prefix_is_not_a_module(simple_dogs, dog_tree_creator):
+    dog_tree = dog_tree_creator(simple_dogs)
+    with pytest.raises(AttributeError):
+        dog_tree.shep
+
+
+def test_exposed_elements_of_module(simple_dogs):
+    assert set(create_dog_tree_no_leaf(simple_dogs).shepard.__dir__()) == {"border", "aussie"}
+    assert set(create_dog_tree(simple_dogs).shepard.__dir__()) == {"border.collie.Falco", "aussie.Momo"}
+
+
+def test_exposed_elements_after_adding_items(simple_dogs, additional_dogs):
+    dog_tree = create_dog_tree_no_leaf(simple_dogs)
+    assert set(dog_tree.shepard.__dir__()) == {"border", "aussie"}
+
+    for dog in additional_dogs:
+        dog_tree.add_item(dog, ".".join(dog.race_hierarchy))
+    assert set(dog_tree.shepard.__dir__()) == {"border", "aussie", "Lucky"}
+
+
+def test_private_attributes_are_not_items(simple_dogs):
+    dog_tree = create_dog_tree(simple_dogs)
+    assert not hasattr(dog_tree, "__deepcopy__")
+    assert not hasattr(dog_tree.shepard, "_exposed")
+
+    copied_tree = copy.deepcopy(dog_tree)
+    assert copied_tree.as_dict() == dog_tree.as_dict()
+
+
+def test_retrieve_dog_only_with_name_after_replacing_it(simple_dogs):
+    dog_tree = create_dog_tree(simple_dogs)
+    falco = Dog(name="Falco", race="shepard.border.collie", age=1)
+    dog_tree.add_item(falco, ".".join(falco.race_hierarchy))
+
+    assert dog_tree.Falco == falco
+    assert dog_tree.shepard.Falco == falco
+
+
+def test_config_with_attribute_names(simple_dogs):
+    dog_tree = AttrTree(config=AttrTreeConfig(item_name="name", item_value="age"))
+    for dog in simple_dogs:
+        dog_tree.add_item(dog, ".".join(dog.race_hierarchy))
+
+    assert dog_tree.as_dict() == {dog.full_name: dog.age for dog in simple_dogs}
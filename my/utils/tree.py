@@ -3,8 +3,9 @@ import sys
 from argparse import ArgumentParser
 from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import (Any, Callable, Dict, Generator, Generic, List, Optional,
-                    Tuple, Type, TypeVar, Union)
+from operator import attrgetter
+from typing import (Any, Callable, Dict, Generic, Iterator, List, Optional,
+                    Tuple, TypeVar, Union)
 
 T = TypeVar("T")
 
@@ -12,26 +13,40 @@ T = TypeVar("T")
 @dataclass
 class AttrTreeConfig(Generic[T]):
     expose_leafs_items: bool = True
-    item_name: Callable[[T], str] = lambda x: x.name
-    item_value: Callable[[T], Any] = lambda x: x.cls
+    # Either a function of the item or the name of one of its attributes
+    item_name: Union[str, Callable[[T], str]] = "name"
+    item_value: Union[str, Callable[[T], Any]] = "cls"
+
+    def __post_init__(self):
+        if isinstance(self.item_name, str):
+            self.item_name = attrgetter(self.item_name)
+        if isinstance(self.item_value, str):
+            self.item_value = attrgetter(self.item_value)
 
 
 @dataclass
 class AttrItem(Generic[T]):
+    # One item is created for every item of a tree, slots keep them small. `segments` (the parts of the full path)
+    # and `fullpath` are computed from the fields
+    __slots__ = ("path", "item_name", "item", "segments", "fullpath")
+
     path: str
     item_name: str
     item: T
 
-    @property
-    def fullpath(self) -> str:
+    def __post_init__(self):
         if self.path:
-            return self.path + "." + self.item_name
+            self.segments = tuple(sys.intern(name) for name in self.path.split(".")) + (sys.intern(self.item_name),)
         else:
-            return self.item_name
+            self.segments = (sys.intern(self.item_name),)
+        self.fullpath = sys.intern(".".join(self.segments))
 
 
 @dataclass(frozen=True)
 class AttrTreeView(Generic[T]):
+    # A view is created on every access to a module of a tree
+    __slots__ = ("origin", "path")
+
     origin: "AttrTree"
     path: str
 
@@ -39,6 +54,9 @@ class AttrTreeView(Generic[T]):
         return self.origin._exposed_elements(self.path)
 
     def __getattr__(self, name):
+        if name.startswith("_"):
+            # Special and private attributes (looked up by copy, pickle, ...) are never items
+            raise AttributeError(name)
         fullname = self.path + "." + name
         return self.origin.get_item(fullname)
 
@@ -52,40 +70,90 @@ class AttrTreeView(Generic[T]):
 @dataclass
 class AttrTree(Generic[T]):
     config: AttrTreeConfig[T]
+    # Items are stored as-is and only converted with `config.item_value` when accessed, so items loading their
+    # value lazily are not loaded when added to the tree
     _exposed: Dict[str, T] = field(default_factory=dict, init=False)
     _items: List[AttrItem[T]] = field(default_factory=list, init=False)
+    # Values of all the items by path, computed on the first `as_list`/`as_dict` and cleared when an item is added
+    _values: Optional[Dict[str, Any]] = field(default=None, init=False, repr=False, compare=False)
+    # Every path of the tree (modules and items) as nested dicts of path parts, so modules are found without
+    # scanning all the items
+    _nodes: Dict[str, Any] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # Exposed elements by module path, as listed by `dir()` and the views representations
+    _elements: Dict[str, List[str]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # Full paths of the items by item name, for lookups with a partial path
+    _by_name: Dict[str, List[str]] = field(default_factory=dict, init=False, repr=False, compare=False)
 
     def add_item(self, item: T, path):
         new_item = AttrItem(path=path, item_name=self.config.item_name(item), item=item)
-        self._exposed[new_item.fullpath] = self.config.item_value(item)
+        if new_item.fullpath not in self._exposed:
+            self._by_name.setdefault(new_item.segments[-1], []).append(new_item.fullpath)
+        self._exposed[new_item.fullpath] = item
         self._items.append(new_item)
+        self._values = None
+        self._elements.clear()
+
+        node = self._nodes
+        for name in new_item.segments:
+            node = node.setdefault(name, {})
+
+    def _node(self, path: str) -> Optional[Dict[str, Any]]:
+        node = self._nodes
+        if path:
+            for name in path.split("."):
+                node = node.get(name)
+                if node is None:
+                    return None
+        return node
+
+    def _subpaths(self, node: Dict[str, Any], prefix: str = "") -> Iterator[str]:
+        """Paths of all the descendants of `node`, relative to it"""
+        # Depth-first with an explicit stack of iterators, in the same order as a recursive walk
+        stack = [(prefix, iter(node.items()))]
+        while stack:
+            parent, children = stack[-1]
+            for name, child in children:
+                path = f"{parent}.{name}" if parent else name
+                yield path
+                if child:
+                    stack.append((path, iter(child.items())))
+                    break
+            else:
+                stack.pop()
+
+    def _all_values(self) -> Dict[str, Any]:
+        if self._values is None:
+            item_value = self.config.item_value
+            self._values = {path: item_value(item) for path, item in self._exposed.items()}
+        return self._values
 
     def _element_is_item(self, fullname):
         return fullname in self._exposed
 
     def _exposed_elements(self, path: str) -> List[str]:
-        exposed = list(set(k[len(path) :] for k in self._exposed.keys() if k.startswith(path)))
-        exposed = [s[1 if s.startswith(".") else 0 :] for s in exposed]
+        elements = self._elements.get(path)
+        if elements is None:
+            elements = self._elements[path] = self._find_exposed_elements(path)
+        return list(elements)
+
+    def _find_exposed_elements(self, path: str) -> List[str]:
+        node = self._node(path)
+        if not node:
+            return []
         if not self.config.expose_leafs_items:
-            modules = set()
-            items = set()
-            for m in exposed:
-                *module, name = m.split(".")
-                if module:
-                    modules.add(module[0])
-                else:
-                    items.add(name)
-
-            exposed = list(modules) + list(items)
-        return exposed
+            # Direct children only: modules and items
+            return list(node)
+
+        prefix = f"{path}." if path else ""
+        return [subpath for subpath in self._subpaths(node) if prefix + subpath in self._exposed]
 
     def _path_is_module(self, path: str) -> bool:
-        return any(k.startswith(path) and k != path for k in self._exposed.keys())
+        return bool(self._node(path))
 
     def get_partial_name(self, fullpath) -> T:
-        *path, name = fullpath.split(".")
-        path = ".".join(path)
-        keys = [k for k in self._exposed.keys() if k.startswith(path) and k.endswith(name)]
+        path, _, name = fullpath.rpartition(".")
+        prefix = f"{path}." if path else ""
+        keys = [key for key in self._by_name.get(name, ()) if key.startswith(prefix)]
         if len(keys) == 1:
             return self.get_item(keys[0])
         else:
@@ -93,15 +161,17 @@ class AttrTree(Generic[T]):
 
     def get_item(self, fullpath) -> Union[T, AttrTreeView[T]]:
         if fullpath in self._exposed:
-            return self._exposed[fullpath]
+            return self.config.item_value(self._exposed[fullpath])
         elif self._path_is_module(fullpath):
             return AttrTreeView(origin=self, path=fullpath)
         return self.get_partial_name(fullpath)
 
     def __getitem__(self, name):
-        return getattr(self, name)
+        return self.get_item(name)
 
     def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
         return self.get_item(name)
 
     def __dir__(self) -> List[str]:
@@ -111,12 +181,24 @@ class AttrTree(Generic[T]):
     def __len__(self) -> int:
         return len(self._exposed)
 
-    def as_list(self) -> List[Tuple[str, T]]:
-        return list(self._exposed.items())
-
-    def as_dict(self) -> Dict[str, T]:
-        return self._exposed.copy()
-
-    def as_tree(self):
-        # TODO
-        pass
+    def paths(self) -> List[str]:
+        """Full paths of the items, without computing their values"""
+        return list(self._exposed.keys())
+
+    def as_list(self) -> List[Tuple[str, Any]]:
+        return list(self._all_values().items())
+
+    def as_dict(self) -> Dict[str, Any]:
+        return self._all_values().copy()
+
+    def as_tree(self) -> Dict[str, Any]:
+        """Nested groups of item names, as `{"name": ..., "items": [...], "groups": {name: group, ...}}`"""
+        root: Dict[str, Any] = {"name": "", "items": [], "groups": {}}
+        for item in self._items:
+            grp = root
+            for name in item.segments[:-1]:
+                if name not in grp["groups"]:
+                    grp["groups"][name] = {"name": name, "items": [], "groups": {}}
+                grp = grp["groups"][name]
+            grp["items"].append(item.item_name)
+        return root